@@ -7,11 +7,14 @@ from pathlib import Path
 import ssl
 import io
 import time
+import zlib
 
 from requests import Session
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+from .profiling import profiled, stage
+
 # https://github.com/amnong/easywebdav/blob/master/easywebdav/client.py
 
 #ftp.voidcmd("XMD5 " + filename)
@@ -20,6 +23,7 @@ from requests.packages.urllib3.util.retry import Retry
 
 class MyFTP_TLS(FTP_TLS):
     """Explicit FTPS, with shared TLS session"""
+    @profiled('ftp.ntransfercmd')
     def ntransfercmd(self, cmd, rest=None):
         conn, size = FTP.ntransfercmd(self, cmd, rest)
         if self._prot_p:
@@ -53,6 +57,82 @@ def iterable_to_stream(iterable, buffer_size=io.DEFAULT_BUFFER_SIZE):
     return io.BufferedReader(IterStream(), buffer_size=buffer_size)
 
 
+class FastqGzipCheck:
+    """Incremental gzip integrity and FASTQ sanity check, fed one transferred chunk at a time"""
+    def __init__(self, max_length=1024*1024, max_line_length=1024*1024):
+        self.max_length = max_length
+        self.max_line_length = max_line_length
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.leftover = b''
+        self.lines = 0
+        self.reads = 0
+        self.bases = 0
+        self.sequence_length = 0
+        self.blank_lines = 0
+
+    def update(self, chunk):
+        data = chunk
+        while data:
+            if self.decompressor.eof:
+                # NUL padding after a member is accepted like gzip/zcat do
+                data = data.lstrip(b'\0')
+                if not data:
+                    break
+                # Concatenated gzip members (e.g. bgzip) start a new stream
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                decompressed = self.decompressor.decompress(data, self.max_length)
+            except zlib.error as e:
+                raise ValueError(f'Corrupt gzip stream after {self.reads} reads: {e}') from e
+            self._check_lines(decompressed)
+            if self.decompressor.eof:
+                data = self.decompressor.unused_data
+            else:
+                data = self.decompressor.unconsumed_tail
+
+    def finish(self):
+        if not self.decompressor.eof:
+            raise ValueError(f'Truncated gzip stream after {self.reads} reads')
+        if self.leftover:
+            self._check_line(self.leftover)
+            self.leftover = b''
+        if self.lines % 4:
+            raise ValueError(f'Truncated FASTQ record after {self.reads} reads')
+        return {'reads': self.reads, 'bases': self.bases}
+
+    def _check_lines(self, decompressed):
+        lines = (self.leftover + decompressed).split(b'\n')
+        self.leftover = lines.pop()
+        for line in lines:
+            self._check_line(line)
+        if self.lines % 4 == 0 and self.leftover and (self.blank_lines or not self.leftover.startswith(b'@')):
+            raise ValueError(f'Invalid FASTQ header after {self.reads} reads: {self.leftover[:50]!r}')
+        if len(self.leftover) > self.max_line_length:
+            raise ValueError(f'FASTQ line longer than {self.max_line_length} bytes after {self.reads} reads')
+
+    def _check_line(self, line):
+        line = line.rstrip(b'\r')
+        kind = self.lines % 4
+        if kind == 0 and not line:
+            # Blank lines are only accepted after the last record
+            self.blank_lines += 1
+            return
+        if kind == 0:
+            if self.blank_lines or not line.startswith(b'@'):
+                raise ValueError(f'Invalid FASTQ header after {self.reads} reads: {line[:50]!r}')
+        elif kind == 1:
+            self.sequence_length = len(line)
+        elif kind == 2:
+            if not line.startswith(b'+'):
+                raise ValueError(f'Invalid FASTQ separator after {self.reads} reads: {line[:50]!r}')
+        elif len(line) != self.sequence_length:
+            raise ValueError(f'FASTQ quality length differs from sequence length in read {self.reads + 1}')
+        else:
+            self.reads += 1
+            self.bases += self.sequence_length
+        self.lines += 1
+
+
 class NextcloudNPCReader:
 
     def __init__(self, webdav_host, webdav_user, webdav_pass, webdav_dir):
@@ -65,6 +145,7 @@ class NextcloudNPCReader:
         adapter = HTTPAdapter(max_retries=retry)
         self.session.mount('https://', adapter)
 
+    @profiled('nextcloud.ls', label=lambda self, webdav_dir: webdav_dir)
     def ls(self, webdav_dir):
 
         list_response = self.session.request(
@@ -79,6 +160,7 @@ class NextcloudNPCReader:
         ]
         return file_list
 
+    @profiled('nextcloud.ls_size', label=lambda self, webdav_dir: webdav_dir)
     def ls_size(self, webdav_dir):
 
         list_response = self.session.request(
@@ -86,14 +168,15 @@ class NextcloudNPCReader:
             f'{self.webdav_host}{webdav_dir}',
             auth=(self.webdav_user, self.webdav_pass)
         )
-        response_xml = ElementTree.fromstring(list_response.content)
-        file_list = [
-            {
-                'filename': Path(e.find('.//d:href', namespaces={'d':'DAV:'}).text).name,
-                'size': {i:int(size.text) for i, size in enumerate(e.findall('.//d:propstat/d:prop/d:getcontentlength', namespaces={'d':'DAV:'}))}.get(0,0),
-            }
-            for e in response_xml.findall('.//d:response', namespaces={'d':'DAV:'})
-        ]
+        with stage('nextcloud.ls_size.parse', webdav_dir):
+            response_xml = ElementTree.fromstring(list_response.content)
+            file_list = [
+                {
+                    'filename': Path(e.find('.//d:href', namespaces={'d':'DAV:'}).text).name,
+                    'size': {i:int(size.text) for i, size in enumerate(e.findall('.//d:propstat/d:prop/d:getcontentlength', namespaces={'d':'DAV:'}))}.get(0,0),
+                }
+                for e in response_xml.findall('.//d:response', namespaces={'d':'DAV:'})
+            ]
         return file_list
 
     def open(self, webdav_path, chunk_size=1024*1024, buffer_factor=1000):
@@ -136,16 +219,30 @@ class ENAFTPWriter:
             ftp.cwd(self.ftp_dir)
             self.ftp = ftp
 
-    def upload(self, filename, file, callback=lambda x: None, blocksize=1020*1024):
+    @profiled('ena_ftp.upload', label=lambda self, filename, *args, **kwargs: filename)
+    def upload(self, filename, file, callback=lambda x: None, blocksize=1020*1024, check=None):
         calculated_md5 = md5()
 
         def update_md5(chunk):
-            calculated_md5.update(chunk)
+            with stage('ena_ftp.upload.md5', filename):
+                calculated_md5.update(chunk)
+            if check is not None:
+                with stage('ena_ftp.upload.check', filename):
+                    check.update(chunk)
             return callback(chunk)
         
         self.establish_connection()
         # APPE
-        self.ftp.storbinary(f"STOR {filename}", file, blocksize=blocksize, callback=update_md5)
+        try:
+            self.ftp.storbinary(f"STOR {filename}", file, blocksize=blocksize, callback=update_md5)
+        except BaseException:
+            # An aborted transfer leaves its reply unread, later commands need a fresh connection
+            try:
+                self.ftp.close()
+            finally:
+                self.ftp = None
+            raise
+        # The caller owns check.finish() and the counts it returns
 
         return calculated_md5.hexdigest()
 
@@ -174,7 +271,8 @@ class ENAFTPWriter:
         return self.ftp.size(filename)
 
 
-def transfer(npc, ena, webdav_dir):
+def transfer(npc, ena, webdav_dir, check_fastq=False):
+    metrics = {}
 
     file_list = npc.ls(webdav_dir)
     ftp_files = ena.ls()
@@ -222,11 +320,16 @@ def transfer(npc, ena, webdav_dir):
             print(f'\rProcessing {filename}: Opening...', end='')
 
             fastq_file = npc.open(file, chunk_size=10*1024*1024, buffer_factor=10)
+            fastq_check = FastqGzipCheck() if check_fastq else None
 
             print(f'\r'+(' '*120), end='')
             print(f'\rProcessing {filename}: Transferred {int(upload_status["bytes"]/1024/1024)} MB', end='')
             
-            ftp_hash = ena.upload(filename, fastq_file, callback=status, blocksize=10*1024*1024)
+            ftp_hash = ena.upload(filename, fastq_file, callback=status, blocksize=10*1024*1024, check=fastq_check)
+            metrics[filename] = {
+                'bytes': upload_status['bytes'],
+                **(fastq_check.finish() if fastq_check else {}),
+            }
 
             print(f'\r'+(' '*120), end='')
             print(f'\rProcessing {filename}: Fisnished {int(upload_status["bytes"]/1024/1024)} MB', end='')
@@ -247,9 +350,13 @@ def transfer(npc, ena, webdav_dir):
 
         if md5_hash == ftp_hash:
             print(f'\r'+(' '*120), end='')
-            print(f'\rSuccessfully uploaded {filename}: {md5_hash}')
+            print(f'\rSuccessfully uploaded {filename}: {md5_hash}' + (
+                f' ({metrics[filename]["reads"]} reads, {metrics[filename]["bases"]} bases)' if check_fastq else ''
+            ))
         else:
             print(f'\r'+(' '*120), end='')
             print(f'\r! Uploaded {filename} with invalid hash: {md5_hash} (given) ≠ {ftp_hash} (ftp)')
 
+    return metrics
+
 
@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+from functools import wraps
+from io import StringIO
+from pathlib import Path
+from threading import Lock
+import atexit
+import cProfile
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+# NBIS_ENA_PROFILE=1 enables the stage timers, extra modes are comma separated,
+# e.g. NBIS_ENA_PROFILE=cprofile,tracemalloc
+PROFILE_ENV = 'NBIS_ENA_PROFILE'
+# Path the report is written to when the interpreter exits, stderr if unset
+PROFILE_REPORT_ENV = 'NBIS_ENA_PROFILE_REPORT'
+
+_enabled = False
+_cprofile = False
+_tracemalloc = False
+_lock = Lock()
+_stats = {}
+_profilers = {}
+_profiling_active = False
+_started_tracemalloc = False
+
+
+def enable(cprofile: bool = False, trace_malloc: bool = False):
+    global _enabled, _cprofile, _tracemalloc, _started_tracemalloc
+    _enabled = True
+    _cprofile = cprofile
+    _tracemalloc = trace_malloc
+    if trace_malloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+
+
+def disable():
+    global _enabled, _cprofile, _tracemalloc, _started_tracemalloc
+    _enabled = _cprofile = _tracemalloc = False
+    # Leave tracing started by someone else running
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _profilers.clear()
+
+
+@contextmanager
+def stage(name: str, label: str = ''):
+    if not _enabled:
+        yield
+        return
+
+    global _profiling_active
+    profiler = None
+    if _cprofile:
+        with _lock:
+            # Only one profiler can be active at a time, nested stages are covered by the outer one
+            if not _profiling_active:
+                profiler = _profilers.get(name)
+                if profiler is None:
+                    profiler = _profilers[name] = cProfile.Profile()
+                _profiling_active = True
+        if profiler is not None:
+            profiler.enable()
+    memory_before = tracemalloc.get_traced_memory()[0] if _tracemalloc else 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        allocated = tracemalloc.get_traced_memory()[0] - memory_before if _tracemalloc else 0
+        with _lock:
+            if profiler is not None:
+                profiler.disable()
+                _profiling_active = False
+            for key in ((name, ''), (name, label)) if label else ((name, ''),):
+                entry = _stats.setdefault(key, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'allocated': 0})
+                entry['calls'] += 1
+                entry['seconds'] += elapsed
+                entry['max_seconds'] = max(entry['max_seconds'], elapsed)
+                entry['allocated'] += allocated
+
+
+def profiled(name: str, label=None):
+    """Decorate a hot path with a stage timer, `label` maps the call arguments to e.g. a file name"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with stage(name, str(label(*args, **kwargs)) if label else ''):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report(fp: Path = None, top: int = 20):
+    with _lock:
+        stats = dict(_stats)
+        profilers = dict(_profilers)
+
+    with StringIO() as f:
+        f.write(f'{"stage":<40} {"label":<40} {"calls":>8} {"total s":>10} {"mean s":>10} {"max s":>10} {"net MB":>10}\n')
+        for (name, label), entry in sorted(stats.items(), key=lambda item: (item[0][0], item[0][1] != '', -item[1]['seconds'])):
+            f.write(
+                f'{name:<40} {label[-40:]:<40} {entry["calls"]:>8} {entry["seconds"]:>10.3f}'
+                f' {entry["seconds"] / entry["calls"]:>10.4f} {entry["max_seconds"]:>10.3f}'
+                f' {entry["allocated"] / 1024 / 1024:>10.2f}\n'
+            )
+
+        for name, profiler in sorted(profilers.items()):
+            f.write(f'\n# cProfile: {name}\n')
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(top)
+
+        if _tracemalloc and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            for key_type in ('filename', 'lineno'):
+                f.write(f'\n# tracemalloc: top allocations by {key_type}\n')
+                for statistic in snapshot.statistics(key_type)[:top]:
+                    f.write(f'{statistic}\n')
+
+        if fp is not None:
+            Path(fp).write_text(f.getvalue())
+        return f.getvalue()
+
+
+def _report_at_exit(report_path: str = ''):
+    if report_path:
+        report(report_path)
+    else:
+        sys.stderr.write(report())
+
+
+def _enable_from_environment():
+    modes = {mode.strip().lower() for mode in os.environ.get(PROFILE_ENV, '').split(',')} - {'', '0', 'false'}
+    if not modes:
+        return
+    enable(cprofile='cprofile' in modes, trace_malloc='tracemalloc' in modes)
+    atexit.register(_report_at_exit, os.environ.get(PROFILE_REPORT_ENV, ''))
+
+
+_enable_from_environment()
@@ -0,0 +1,156 @@
+from typing import NamedTuple, Iterable, List, Dict, Optional
+from datetime import datetime, timezone
+from xml.etree.ElementTree import iterparse
+from pathlib import Path
+from re import sub
+import sqlite3
+
+from .xml import submission_xml
+
+OBJECT_TYPES = ('PROJECT', 'STUDY', 'SAMPLE', 'EXPERIMENT', 'RUN', 'ANALYSIS', 'SUBMISSION')
+
+# ENA adds this INFO message to receipts from the test server (wwwdev), whose aliases
+# overlap with production and whose objects are discarded
+TEST_SUBMISSION_MESSAGE = 'This submission is a TEST submission'
+
+# Keep bulk lookups below SQLite's default host parameter limit
+_LOOKUP_BATCH_SIZE = 500
+
+
+class ReceiptEntry(NamedTuple):
+    alias: str
+    accession: str
+    object_type: str
+    submitted: str
+
+
+def _utc_receipt_date(receipt_date: str) -> str:
+    # Fixed width UTC timestamps so the stored strings order chronologically
+    if not receipt_date:
+        return ''
+    date = datetime.fromisoformat(sub('Z$', '+00:00', receipt_date))
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def iter_receipt(fp) -> Iterable[ReceiptEntry]:
+    """Stream the accessioned objects out of an ENA receipt XML file, skipping test submissions"""
+    submitted = ''
+    test = False
+    entries = []
+    for event, element in iterparse(fp, events=('start', 'end')):
+        if event == 'start':
+            if element.tag == 'RECEIPT':
+                submitted = _utc_receipt_date(element.get('receiptDate', ''))
+                test = False
+                entries = []
+            continue
+        if element.tag in OBJECT_TYPES:
+            accession = element.get('accession')
+            if accession:
+                entries.append(ReceiptEntry(element.get('alias', ''), accession, element.tag, submitted))
+            element.clear()
+        elif element.tag == 'INFO':
+            test = test or TEST_SUBMISSION_MESSAGE in (element.text or '')
+        elif element.tag == 'MESSAGES':
+            element.clear()
+        elif element.tag == 'RECEIPT':
+            # The test marker follows the objects, so entries are held until the receipt ends
+            if not test:
+                yield from entries
+            element.clear()
+
+
+class ReceiptStore:
+    """Local index of alias, accession, object type and submission time from ENA receipts"""
+
+    def __init__(self, db_path: str = ':memory:'):
+        self.db_path = str(db_path)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS receipt (
+                alias TEXT NOT NULL,
+                accession TEXT NOT NULL,
+                object_type TEXT NOT NULL,
+                submitted TEXT NOT NULL,
+                PRIMARY KEY (alias, object_type)
+            );
+            CREATE INDEX IF NOT EXISTS receipt_accession ON receipt (accession);
+        ''')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ingest(self, *receipt_files) -> int:
+        count = 0
+        with self.db:
+            for fp in receipt_files:
+                cursor = self.db.executemany(
+                    'INSERT INTO receipt (alias, accession, object_type, submitted) VALUES (?, ?, ?, ?)'
+                    ' ON CONFLICT (alias, object_type) DO UPDATE'
+                    ' SET accession = excluded.accession, submitted = excluded.submitted'
+                    ' WHERE excluded.submitted >= receipt.submitted',
+                    iter_receipt(str(fp) if isinstance(fp, Path) else fp),
+                )
+                count += cursor.rowcount
+        return count
+
+    def entries(self, aliases: Iterable[str], object_type: Optional[str] = None) -> List[ReceiptEntry]:
+        aliases = list(dict.fromkeys(aliases))
+        type_filter = ' AND object_type = ?' if object_type else ''
+        found: Dict[str, List[ReceiptEntry]] = {}
+        for i in range(0, len(aliases), _LOOKUP_BATCH_SIZE):
+            batch = aliases[i:i + _LOOKUP_BATCH_SIZE]
+            rows = self.db.execute(
+                f'SELECT alias, accession, object_type, submitted FROM receipt'
+                f' WHERE alias IN ({",".join("?" * len(batch))}){type_filter}',
+                batch + ([object_type] if object_type else []),
+            )
+            for row in rows:
+                found.setdefault(row[0], []).append(ReceiptEntry(*row))
+
+        missing = [alias for alias in aliases if alias not in found]
+        if missing:
+            raise KeyError(f'{len(missing)} aliases not found in receipts: {", ".join(missing[:10])}')
+        ambiguous = [alias for alias in aliases if len(found[alias]) > 1]
+        if ambiguous:
+            raise ValueError(f'{len(ambiguous)} aliases match several object types, give object_type: {", ".join(ambiguous[:10])}')
+        return [found[alias][0] for alias in aliases]
+
+    def accessions(self, aliases: Iterable[str], object_type: Optional[str] = None) -> List[str]:
+        return [entry.accession for entry in self.entries(aliases, object_type)]
+
+    def alias(self, accession: str) -> ReceiptEntry:
+        row = self.db.execute(
+            'SELECT alias, accession, object_type, submitted FROM receipt WHERE accession = ?',
+            (accession,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(accession)
+        return ReceiptEntry(*row)
+
+    def action_xml(self, fp: Path, action: str, aliases: Iterable[str], object_type: Optional[str] = None):
+        entries = self.entries(aliases, object_type)
+        submissions = [entry.alias for entry in entries if entry.object_type == 'SUBMISSION']
+        if submissions:
+            raise ValueError(f'Cannot {action} submission objects: {", ".join(submissions[:10])}')
+        submission_xml(fp, (
+            (action, {'target': entry.accession})
+            for entry in entries
+        ))
+
+    def cancel_xml(self, fp: Path, aliases: Iterable[str], object_type: Optional[str] = None):
+        self.action_xml(fp, 'CANCEL', aliases, object_type)
+
+    def suppress_xml(self, fp: Path, aliases: Iterable[str], object_type: Optional[str] = None):
+        self.action_xml(fp, 'SUPPRESS', aliases, object_type)
+
+    def release_xml(self, fp: Path, aliases: Iterable[str], object_type: Optional[str] = None):
+        self.action_xml(fp, 'RELEASE', aliases, object_type)
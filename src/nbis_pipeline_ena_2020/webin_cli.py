@@ -1,5 +1,7 @@
 from subprocess import run
 
+from .profiling import profiled
+
 
 class WebinCLI:
     username: str
@@ -32,6 +34,7 @@ class WebinCLI:
             + (['-test'] if self.test else [])
         )
 
+    @profiled('webin_cli.run', label=lambda self, manifest_file, *args, **kwargs: manifest_file)
     def webin_cli_run(self, manifest_file: str, submit: bool = False):
         cli_command = self.webin_cli_command(manifest_file, submit)
         return run(cli_command, env={'WEBIN_PW':self.password})
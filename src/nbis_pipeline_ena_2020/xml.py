@@ -7,6 +7,8 @@ from io import StringIO
 from requests import post
 from requests.auth import HTTPBasicAuth
 
+from .profiling import profiled
+
 class Sample(NamedTuple):
     alias: str
     title: str
@@ -63,6 +65,7 @@ def study_xml(fp: Path, project_id:str, title: str, description: str, ):
         fp.write_text(f.getvalue())
 
 
+@profiled('xml.samples_tsv2xml', label=lambda fp, *args, **kwargs: fp)
 def samples_tsv2xml(fp: Path, samples_list: List[Sample], checklist_id:str='', prefix:str = ''):
     with StringIO() as f:
         f.write('<?xml version="1.0" encoding="UTF-8" standalone="no" ?>\n')
@@ -135,7 +138,7 @@ def submission_suppress_xml(fp: Path, accessions: list):
 
 def submission_release_xml(fp: Path, accessions: list):
     submission_xml(fp, (
-        ('SUPPRESS', {'target': accession})
+        ('RELEASE', {'target': accession})
         for accession in accessions
     ))
 
@@ -0,0 +1,108 @@
+from gzip import compress
+from io import BytesIO
+
+import pytest
+
+from nbis_pipeline_ena_2020.ena_transfer import FastqGzipCheck, ENAFTPWriter
+
+fastq = b''.join(
+    b'@read%d\n%s\n+\n%s\n' % (i, b'ACGT' * 25, b'I' * 100)
+    for i in range(1000)
+)
+
+
+def check(data, chunk_size=4096, **kwargs):
+    c = FastqGzipCheck(**kwargs)
+    for i in range(0, len(data), chunk_size):
+        c.update(data[i:i + chunk_size])
+    return c.finish()
+
+
+def test_single_member():
+    assert check(compress(fastq)) == {'reads': 1000, 'bases': 100000}
+
+
+def test_multi_member():
+    half = len(fastq) // 2
+    data = compress(fastq[:half]) + compress(fastq[half:])
+    assert check(data, chunk_size=7) == {'reads': 1000, 'bases': 100000}
+
+
+def test_empty_gzip():
+    assert check(compress(b'')) == {'reads': 0, 'bases': 0}
+
+
+def test_empty_input():
+    with pytest.raises(ValueError, match='Truncated gzip'):
+        check(b'')
+
+
+def test_truncated_gzip():
+    with pytest.raises(ValueError, match='Truncated gzip'):
+        check(compress(fastq)[:-10])
+
+
+def test_corrupt_deflate():
+    data = bytearray(compress(fastq))
+    data[100:110] = b'\xff' * 10
+    with pytest.raises(ValueError):
+        check(bytes(data))
+
+
+def test_quality_length_mismatch():
+    with pytest.raises(ValueError, match='quality length'):
+        check(compress(fastq[:-2] + b'\n'))
+
+
+def test_invalid_header_without_newline():
+    c = FastqGzipCheck()
+    with pytest.raises(ValueError, match='header'):
+        c.update(compress(b'>not fastq'))
+
+
+def test_line_length_bounded():
+    c = FastqGzipCheck(max_line_length=1000)
+    with pytest.raises(ValueError, match='longer than'):
+        c.update(compress(b'@' + b'A' * 5000))
+
+
+class FakeFTP:
+    closed = False
+
+    def voidcmd(self, cmd):
+        pass
+
+    def storbinary(self, cmd, fp, blocksize, callback):
+        callback(fp.read())
+
+    def close(self):
+        self.closed = True
+
+
+def test_upload_check_failure_drops_connection():
+    ena = ENAFTPWriter('host', 'user', 'pass', 'dir')
+    ftp = ena.ftp = FakeFTP()
+    with pytest.raises(ValueError):
+        ena.upload('a.fq.gz', BytesIO(compress(b'>not fastq\n')), check=FastqGzipCheck())
+    assert ftp.closed
+    assert ena.ftp is None
+
+
+def test_trailing_blank_lines():
+    assert check(compress(fastq + b'\n\n')) == {'reads': 1000, 'bases': 100000}
+
+
+def test_blank_line_between_records():
+    with pytest.raises(ValueError, match='header'):
+        check(compress(b'@a\nAC\n+\nII\n\n@b\nAC\n+\nII\n'))
+
+
+def test_zero_padding_after_last_member():
+    data = compress(fastq) + b'\0' * 1024
+    assert check(data, chunk_size=100) == {'reads': 1000, 'bases': 100000}
+
+
+def test_member_after_zero_padding():
+    half = len(fastq) // 2
+    data = compress(fastq[:half]) + b'\0' * 10 + compress(fastq[half:])
+    assert check(data) == {'reads': 1000, 'bases': 100000}
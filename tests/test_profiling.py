@@ -0,0 +1,138 @@
+import atexit
+import tracemalloc
+from io import BytesIO
+
+import pytest
+
+from nbis_pipeline_ena_2020 import profiling, webin_cli
+from nbis_pipeline_ena_2020.ena_transfer import ENAFTPWriter, NextcloudNPCReader
+from nbis_pipeline_ena_2020.xml import samples_tsv2xml
+
+
+@pytest.fixture(autouse=True)
+def clean_profiling():
+    profiling.disable()
+    profiling.reset()
+    yield
+    profiling.disable()
+    profiling.reset()
+
+
+def stage_keys():
+    return set(profiling._stats)
+
+
+def test_disabled_calls_through():
+    def label(*args, **kwargs):
+        raise AssertionError('label evaluated while disabled')
+
+    @profiling.profiled('test.func', label=label)
+    def func(x, y=1):
+        return x + y
+
+    assert func(1, y=2) == 3
+    assert stage_keys() == set()
+
+
+def test_profiled_labels(tmp_path, monkeypatch):
+    profiling.enable()
+
+    samples_tsv2xml(tmp_path / 'samples.xml', [])
+
+    monkeypatch.setattr(webin_cli, 'run', lambda command, env: None)
+    webin_cli.WebinCLI('user', 'pass').webin_cli_run('sample.manifest', submit=True)
+
+    class FakeFTP:
+        def voidcmd(self, cmd):
+            pass
+
+        def storbinary(self, cmd, fp, blocksize, callback):
+            callback(fp.read())
+
+    ena = ENAFTPWriter('host', 'user', 'pass', 'dir')
+    ena.ftp = FakeFTP()
+    ena.upload('a.fq.gz', BytesIO(b'data'))
+    ena.upload(filename='b.fq.gz', file=BytesIO(b'data'))
+
+    class FakeResponse:
+        content = (
+            b'<d:multistatus xmlns:d="DAV:"><d:response><d:href>/dir/a.fq.gz</d:href>'
+            b'<d:propstat><d:prop><d:getcontentlength>4</d:getcontentlength></d:prop></d:propstat>'
+            b'</d:response></d:multistatus>'
+        )
+
+    npc = NextcloudNPCReader('https://host', 'user', 'pass', '/dir/')
+    monkeypatch.setattr(npc.session, 'request', lambda *args, **kwargs: FakeResponse())
+    assert npc.ls_size('/dir/') == [{'filename': 'a.fq.gz', 'size': 4}]
+
+    assert {
+        ('xml.samples_tsv2xml', str(tmp_path / 'samples.xml')),
+        ('webin_cli.run', 'sample.manifest'),
+        ('ena_ftp.upload', 'a.fq.gz'),
+        ('ena_ftp.upload', 'b.fq.gz'),
+        ('ena_ftp.upload.md5', 'a.fq.gz'),
+        ('nextcloud.ls_size', '/dir/'),
+        ('nextcloud.ls_size.parse', '/dir/'),
+    } <= stage_keys()
+    assert profiling._stats[('ena_ftp.upload', '')]['calls'] == 2
+
+
+def test_cprofile_one_profiler_at_a_time():
+    profiling.enable(cprofile=True)
+    with profiling.stage('outer'):
+        with profiling.stage('inner'):
+            sum(range(100))
+    outer = profiling._profilers['outer']
+    with profiling.stage('outer'):
+        pass
+
+    assert set(profiling._profilers) == {'outer'}
+    assert profiling._profilers['outer'] is outer
+    assert profiling._stats[('inner', '')]['calls'] == 1
+    assert profiling._stats[('outer', '')]['calls'] == 2
+    assert '# cProfile: outer' in profiling.report()
+
+
+def test_tracemalloc_net_allocation():
+    profiling.enable(trace_malloc=True)
+    with profiling.stage('alloc'):
+        kept = bytearray(4 * 1024 * 1024)
+    assert profiling._stats[('alloc', '')]['allocated'] >= len(kept)
+    text = profiling.report()
+    assert 'net MB' in text
+    assert '# tracemalloc: top allocations by filename' in text
+
+
+def test_disable_keeps_external_tracemalloc():
+    tracemalloc.start()
+    try:
+        profiling.enable(trace_malloc=True)
+        profiling.disable()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_report_writes_file(tmp_path):
+    profiling.enable()
+    with profiling.stage('test.stage', 'file.fq.gz'):
+        pass
+    report_file = tmp_path / 'report.txt'
+    text = profiling.report(report_file)
+    assert report_file.read_text() == text
+    assert 'file.fq.gz' in text
+
+
+def test_environment_registers_stderr_report(monkeypatch, capsys):
+    registered = []
+    monkeypatch.setattr(atexit, 'register', lambda func, *args: registered.append((func, args)))
+    monkeypatch.setenv(profiling.PROFILE_ENV, '1')
+    monkeypatch.delenv(profiling.PROFILE_REPORT_ENV, raising=False)
+    profiling._enable_from_environment()
+    with profiling.stage('test.stage', 'file.fq.gz'):
+        pass
+    [(func, args)] = registered
+    func(*args)
+    err = capsys.readouterr().err
+    assert 'test.stage' in err
+    assert 'file.fq.gz' in err
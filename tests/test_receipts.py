@@ -0,0 +1,126 @@
+from pathlib import Path
+
+import pytest
+
+from nbis_pipeline_ena_2020.receipts import ReceiptStore, _LOOKUP_BATCH_SIZE
+from nbis_pipeline_ena_2020.xml import submission_release_xml
+
+
+def write_receipt(fp: Path, receipt_date: str, accession: str, test: bool = False):
+    message = '<INFO>This submission is a TEST submission and will be discarded within 24 hours</INFO>' if test else ''
+    fp.write_text(
+        f'<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<RECEIPT receiptDate="{receipt_date}" submissionFile="submission.xml" success="true">\n'
+        f'    <SAMPLE accession="{accession}" alias="sample1" status="PRIVATE">\n'
+        f'        <EXT_ID accession="SAMEA{accession}" type="biosample"/>\n'
+        f'    </SAMPLE>\n'
+        f'    <SUBMISSION accession="ERA{accession}" alias="submission1"/>\n'
+        f'    <MESSAGES>{message}</MESSAGES>\n'
+        f'    <ACTIONS>ADD</ACTIONS>\n'
+        f'</RECEIPT>\n'
+    )
+    return fp
+
+
+def write_bulk_receipt(fp: Path, objects):
+    fp.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<RECEIPT receiptDate="2021-01-01T10:00:00.000Z" submissionFile="submission.xml" success="true">\n'
+        + ''.join(
+            f'    <{object_type} accession="{accession}" alias="{alias}" status="PRIVATE"/>\n'
+            for object_type, alias, accession in objects
+        )
+        + '    <SUBMISSION accession="ERA1" alias="submission1"/>\n'
+        '</RECEIPT>\n'
+    )
+    return fp
+
+
+@pytest.fixture
+def bulk_store(tmp_path):
+    count = 2 * _LOOKUP_BATCH_SIZE + 1
+    receipt = write_bulk_receipt(tmp_path / 'receipt.xml', [
+        *(('SAMPLE', f'sample{i}', f'ERS{i}') for i in range(count)),
+        ('RUN', 'sample0', 'ERR0'),
+    ])
+    with ReceiptStore() as store:
+        store.ingest(receipt)
+        yield store
+
+
+def test_newest_receipt_wins_regardless_of_ingestion_order(tmp_path):
+    old = write_receipt(tmp_path / 'old.xml', '2021-01-01T10:00:00.000Z', 'ERS1')
+    new = write_receipt(tmp_path / 'new.xml', '2021-02-01T10:00:00.000Z', 'ERS2')
+    with ReceiptStore() as store:
+        store.ingest(new, old)
+        assert store.accessions(['sample1'], 'SAMPLE') == ['ERS2']
+    with ReceiptStore() as store:
+        store.ingest(old, new)
+        assert store.accessions(['sample1'], 'SAMPLE') == ['ERS2']
+
+
+def test_receipt_dates_with_mixed_offsets(tmp_path):
+    # 10:30+01:00 is 09:30 UTC, earlier than 10:00Z although it sorts later as text
+    old = write_receipt(tmp_path / 'old.xml', '2021-03-28T10:30:00.000+01:00', 'ERS1')
+    new = write_receipt(tmp_path / 'new.xml', '2021-03-28T10:00:00.000+00:00', 'ERS2')
+    with ReceiptStore() as store:
+        store.ingest(new, old)
+        [entry] = store.entries(['sample1'], 'SAMPLE')
+    assert entry.accession == 'ERS2'
+    assert entry.submitted == '2021-03-28T10:00:00.000000Z'
+
+
+def test_test_receipts_are_skipped(tmp_path):
+    production = write_receipt(tmp_path / 'prod.xml', '2021-01-01T10:00:00.000Z', 'ERS1')
+    test = write_receipt(tmp_path / 'test.xml', '2021-02-01T10:00:00.000Z', 'ERS2', test=True)
+    with ReceiptStore() as store:
+        store.ingest(production, test)
+        assert store.accessions(['sample1'], 'SAMPLE') == ['ERS1']
+        with pytest.raises(KeyError):
+            store.alias('ERS2')
+
+
+def test_bulk_lookup_across_batches(bulk_store):
+    aliases = [f'sample{i}' for i in reversed(range(2 * _LOOKUP_BATCH_SIZE + 1))]
+    assert bulk_store.accessions(aliases, 'SAMPLE') == [alias.replace('sample', 'ERS') for alias in aliases]
+
+
+def test_missing_aliases(bulk_store):
+    with pytest.raises(KeyError, match='2 aliases not found in receipts: missing1, missing2'):
+        bulk_store.accessions(['sample1', 'missing1', 'missing2'], 'SAMPLE')
+
+
+def test_alias_with_several_object_types(bulk_store):
+    with pytest.raises(ValueError, match='sample0'):
+        bulk_store.accessions(['sample0', 'sample1'])
+    assert bulk_store.accessions(['sample0'], 'RUN') == ['ERR0']
+
+
+def test_cancel_and_suppress_xml(bulk_store, tmp_path):
+    bulk_store.cancel_xml(tmp_path / 'cancel.xml', ['sample1', 'sample2'], 'SAMPLE')
+    bulk_store.suppress_xml(tmp_path / 'suppress.xml', ['sample0'], 'RUN')
+    cancel = (tmp_path / 'cancel.xml').read_text()
+    assert '<CANCEL target="ERS1"/>' in cancel
+    assert '<CANCEL target="ERS2"/>' in cancel
+    assert cancel.count('<ACTION>') == 2
+    suppress = (tmp_path / 'suppress.xml').read_text()
+    assert '<SUPPRESS target="ERR0"/>' in suppress
+    assert suppress.count('<ACTION>') == 1
+
+
+def test_release_xml(tmp_path):
+    receipt = write_receipt(tmp_path / 'receipt.xml', '2021-01-01T10:00:00.000Z', 'ERS1')
+    with ReceiptStore() as store:
+        store.ingest(receipt)
+        store.release_xml(tmp_path / 'release.xml', ['sample1'], 'SAMPLE')
+        with pytest.raises(ValueError):
+            store.release_xml(tmp_path / 'release.xml', ['submission1'])
+    assert '<RELEASE target="ERS1"/>' in (tmp_path / 'release.xml').read_text()
+
+
+def test_submission_release_xml(tmp_path):
+    submission_release_xml(tmp_path / 'release.xml', ['ERS1', 'ERS2'])
+    text = (tmp_path / 'release.xml').read_text()
+    assert '<RELEASE target="ERS1"/>' in text
+    assert '<RELEASE target="ERS2"/>' in text
+    assert 'SUPPRESS' not in text